@@ -0,0 +1,34 @@
+# chat_history.py
+import streamlit as st
+
+# === 대화 기록 렌더링 설정 ===
+RECENT_TURNS = 5  # rerun마다 전체 렌더링할 최근 턴 수
+PAGE_TURNS = 5    # "이전 대화 더 보기" 한 번에 추가로 펼칠 턴 수
+
+
+def _visible_turns_key(key: str) -> str:
+    return f"{key}_visible_turns"
+
+
+def _show_more(key: str):
+    st.session_state[_visible_turns_key(key)] = st.session_state.get(_visible_turns_key(key), RECENT_TURNS) + PAGE_TURNS
+
+
+def _show_recent(key: str):
+    st.session_state[_visible_turns_key(key)] = RECENT_TURNS
+
+
+def render_history(transcript, render_fn, key: str):
+    """최근 턴(user 메시지로 시작하는 묶음)만 렌더링합니다.
+    오래된 턴은 그리지 않고 버튼으로 펼치므로, 대화가 길어져도 rerun 비용이 거의 일정합니다.
+    transcript는 transcript_store.SessionTranscript이며, 메모리 밖의 턴은 펼칠 때 저장소에서 읽습니다."""
+    visible_turns = st.session_state.get(_visible_turns_key(key), RECENT_TURNS)
+    messages, hidden_turns = transcript.tail_turns(visible_turns)
+
+    if hidden_turns:
+        st.button(f"⬆️ 이전 대화 더 보기 (숨겨진 턴 {hidden_turns}개)", key=f"{key}_show_more", on_click=_show_more, args=(key,))
+    elif visible_turns > RECENT_TURNS:
+        st.button("⬇️ 최근 대화만 보기", key=f"{key}_show_recent", on_click=_show_recent, args=(key,))
+
+    for msg_data in messages:
+        render_fn(msg_data)
@@ -0,0 +1,258 @@
+# message_pipeline.py
+import json
+import os
+import time
+from dataclasses import dataclass, field
+import streamlit as st
+from langchain_core.messages import AIMessage, ToolMessage
+
+from model_router import format_route_caption
+
+# === 스트리밍 이벤트 종류 ===
+TOKEN = "token"            # 모델이 생성한 텍스트 조각
+TOOL_START = "tool_start"  # 도구 호출 시작 (이름, 입력)
+TOOL_END = "tool_end"      # 도구 실행 결과
+ERROR = "error"            # 스트리밍 중 오류
+TEXT = "text"              # 저장용: 연속된 TOKEN을 합친 텍스트
+
+TYPING_SPEED = 0.01  # 한 번에 도착한 긴 텍스트를 타이핑 효과로 보여줄 때의 글자당 지연
+STREAM_DEBUG = os.getenv("STREAM_DEBUG") == "1"  # 이벤트별 로그 출력 여부
+
+
+@dataclass
+class StreamEvent:
+    kind: str
+    content: object = None
+    name: str = None
+    input: object = None
+
+    def to_record(self) -> dict:
+        """세션/저장소에 보관할 dict로 변환합니다. 도구 payload는 이 시점에 한 번만 파싱하고,
+        원본 대신 렌더링용 view만 보관해 같은 내용을 두 번 저장하지 않습니다."""
+        if self.kind == TOOL_START:
+            return {"type": TOOL_START, "name": self.name, "input_view": prepare_tool_view(None, self.input) if self.input else None}
+        if self.kind == TOOL_END:
+            return {"type": TOOL_END, "name": self.name, "view": prepare_tool_view(self.name, self.content)}
+        return {"type": self.kind, "content": self.content}
+
+
+@dataclass
+class StreamMetrics:
+    started: float = field(default_factory=time.perf_counter)
+    first_token: float = None  # 시작 후 첫 TOKEN까지 걸린 시간
+    source_wait: float = 0.0   # 이벤트 소스(모델/에이전트)를 기다린 시간 (렌더링 시간 제외)
+    events: int = 0
+    error: bool = False
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+
+# === 도구 payload 처리 ===
+
+def is_restaurant_tool(name) -> bool:
+    return bool(name) and ("맛집" in name or "restaurant" in name.lower())
+
+
+def prepare_tool_view(name, content) -> dict:
+    """도구 입력/결과를 저장 시점에 한 번만 파싱해 렌더링용 payload로 만듭니다.
+    rerun 때는 json.loads / json.dumps 없이 payload를 그대로 그립니다."""
+    try:
+        parsed = json.loads(content) if isinstance(content, str) else content
+        if is_restaurant_tool(name) and isinstance(parsed, list):
+            return {"kind": "dataframe", "data": parsed}
+        return {"kind": "json", "data": json.dumps(parsed, indent=2, ensure_ascii=False, default=str)}
+    except (json.JSONDecodeError, TypeError):
+        return {"kind": "text", "data": str(content)}
+
+
+def render_tool_view(view: dict):
+    if view["kind"] == "dataframe":
+        st.dataframe(view["data"])
+    elif view["kind"] == "json":
+        st.code(view["data"], language="json")
+    else:
+        st.code(view["data"], language="text")
+
+
+# === 이벤트 소스 ===
+
+def message_text(content) -> str:
+    """AIMessage(Chunk).content (문자열 또는 content block 리스트)에서 텍스트만 추출합니다."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(p.get("text", "") for p in content if isinstance(p, dict) and p.get("type") == "text")
+    return str(content)
+
+
+def llm_token_events(chunks):
+    """chat model / LCEL 체인의 .stream() 청크를 TOKEN 이벤트로 변환합니다."""
+    for chunk in chunks:
+        if text := message_text(getattr(chunk, "content", chunk)):
+            yield StreamEvent(TOKEN, text)
+
+
+def agent_events(updates):
+    """LangGraph 에이전트의 stream_mode="updates" 청크를 이벤트로 변환합니다."""
+    for chunk in updates:
+        if not isinstance(chunk, dict):
+            continue
+        if agent_messages := chunk.get("agent", {}).get("messages", []):
+            msg = agent_messages[-1]
+            if isinstance(msg, AIMessage):
+                if text := message_text(msg.content):
+                    yield StreamEvent(TOKEN, text)
+                for tool_call in getattr(msg, "tool_calls", None) or []:
+                    yield StreamEvent(TOOL_START, name=tool_call.get("name"), input=tool_call.get("args"))
+        elif tool_messages := chunk.get("tools", {}).get("messages", []):
+            for msg in tool_messages:
+                if isinstance(msg, ToolMessage):
+                    yield StreamEvent(TOOL_END, content=msg.content, name=msg.name)
+
+
+# === 계측 ===
+
+def instrument(event: StreamEvent, metrics: StreamMetrics):
+    """모든 페이지의 스트리밍 이벤트가 지나가는 단일 계측 지점."""
+    metrics.events += 1
+    if event.kind == TOKEN and metrics.first_token is None:
+        metrics.first_token = metrics.total
+    if event.kind == ERROR:
+        metrics.error = True
+    if STREAM_DEBUG:
+        print(f"[stream] +{metrics.total:.3f}s {event.kind} {event.name or ''} {str(event.content)[:80]!r}")
+
+
+def _instrumented(events, metrics: StreamMetrics, error_prefix: str):
+    """소스 이벤트를 계측하며 전달하고, 소스에서 난 예외는 ERROR 이벤트로 바꿉니다."""
+    iterator = iter(events)
+    while True:
+        wait_started = time.perf_counter()
+        try:
+            event = next(iterator)
+        except StopIteration:
+            metrics.source_wait += time.perf_counter() - wait_started
+            return
+        except Exception as e:
+            metrics.source_wait += time.perf_counter() - wait_started
+            event = StreamEvent(ERROR, f"{error_prefix}: {e}")
+            instrument(event, metrics)
+            yield event
+            return
+        metrics.source_wait += time.perf_counter() - wait_started
+        instrument(event, metrics)
+        yield event
+
+
+# === 렌더링 ===
+
+def _typed(text: str, speed: float):
+    if speed <= 0 or len(text) <= 1:
+        yield text
+        return
+    for char in text:
+        yield char
+        time.sleep(speed)
+
+
+def stream_turn(events, typing_speed: float = 0.0, error_prefix: str = "응답 생성 중 오류 발생"):
+    """이벤트를 즉시 렌더링하고, 저장용 record 리스트와 계측 결과를 반환합니다.
+    연속된 TOKEN은 하나의 st.write_stream으로 묶어 그리고, 저장 시에는 TEXT record 하나로 합칩니다.
+    (호출하는 곳에서 st.chat_message("assistant") 컨텍스트 안에서 사용)"""
+    metrics = StreamMetrics()
+    records = []
+    source = _instrumented(events, metrics, error_prefix)
+    event = next(source, None)
+    while event is not None:
+        if event.kind == TOKEN:
+            buffer = []
+
+            def tokens():
+                nonlocal event
+                while event is not None and event.kind == TOKEN:
+                    buffer.append(event.content)
+                    yield from _typed(event.content, typing_speed)
+                    event = next(source, None)
+
+            st.write_stream(tokens())
+            records.append({"type": TEXT, "content": "".join(buffer)})
+            continue
+        record = event.to_record()
+        render_record(record)
+        records.append(record)
+        event = next(source, None)
+
+    if STREAM_DEBUG:
+        print(f"[stream] done: events={metrics.events} first_token={metrics.first_token} "
+              f"source_wait={metrics.source_wait:.3f}s total={metrics.total:.3f}s")
+    return records, metrics
+
+
+def turn_text(records: list) -> str:
+    """저장된 record에서 모델 텍스트만 이어 붙입니다. (메모리 저장용)"""
+    return "".join(r["content"] for r in records if r.get("type") == TEXT)
+
+
+def restored_turns(messages: list):
+    """저장된 표시용 기록에서 (모델 입력, 모델 출력) 쌍을 순서대로 꺼냅니다. (재접속 시 메모리 복원용)
+    오류로 끝난 턴은 원래도 메모리에 저장하지 않았으므로 건너뜁니다."""
+    user_input = None
+    for msg in messages:
+        role = msg.get("role")
+        if role == "user":
+            user_input = msg.get("content")
+        elif role == "assistant" and user_input is not None:
+            content = msg.get("content")
+            if isinstance(content, list):
+                if any(record.get("type") == ERROR for record in content):
+                    user_input = None
+                    continue
+                output = turn_text(content)
+            else:
+                output = content or ""  # 이전 형식 기록 (문자열)
+            if output:
+                yield msg.get("llm_input", user_input), output
+            user_input = None
+
+
+def render_record(record: dict):
+    kind = record.get("type")
+    content = record.get("content")
+    name = record.get("name")
+    if kind in (TEXT, "ai"):  # "ai"는 이전 형식 기록
+        if content:
+            st.markdown(content)
+    elif kind == TOOL_START:
+        st.info(f"🛠️ **{name or '?'}** 도구 호출 중...", icon="🔄")
+        # 이전 형식 기록은 input 원본만 있으므로 즉석에서 변환
+        if input_view := record.get("input_view") or (record.get("input") and prepare_tool_view(None, record["input"])):
+            with st.expander("도구 입력 보기", expanded=False):
+                render_tool_view(input_view)
+    elif kind == TOOL_END:
+        render_tool_view(record.get("view") or prepare_tool_view(name, content))
+    elif kind == ERROR:
+        st.error(content)
+
+
+def render_message(msg_data: dict):
+    """저장된 메시지 하나를 렌더링합니다. (세 페이지 공통)"""
+    role = msg_data.get("role")
+    content = msg_data.get("content")
+    if role == "user":
+        with st.chat_message("user"):
+            st.markdown(content)
+    elif role == "assistant":
+        with st.chat_message("assistant"):
+            if isinstance(content, list):
+                for record in content:
+                    render_record(record)
+            elif content:
+                st.markdown(content)  # 이전 형식 기록 (문자열)
+            if route_info := msg_data.get("routing"):
+                st.caption(format_route_caption(route_info))
+    elif role == "tool_result":
+        name = msg_data.get("name")
+        with st.expander(f"첨부된 {name} 정보", expanded=True):
+            render_tool_view(msg_data.get("view") or prepare_tool_view(name, content))
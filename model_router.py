@@ -0,0 +1,168 @@
+# model_router.py
+import re
+import time
+from dataclasses import dataclass, asdict
+
+# === 모델 설정 ===
+# 가벼운 턴은 빠르고 저렴한 모델, 도구/추론이 필요한 턴은 큰 모델로 보냅니다.
+FAST_MODEL = "claude-3-5-haiku-latest"
+SMART_MODEL = "claude-3-5-sonnet-latest"
+DEFAULT_TEMPERATURE = 0.7
+
+FAST_TIER = "fast"
+SMART_TIER = "smart"
+
+# 이 길이를 넘는 입력은 짧은 대화로 보지 않습니다.
+FAST_MAX_CHARS = 60
+
+# 도구(날씨/맛집 등)가 필요해 보이는 표현
+TOOL_HINTS = (
+    "날씨", "기온", "강수", "미세먼지", "맛집", "식당", "음식", "메뉴", "카페", "검색", "찾아",
+    "weather", "forecast", "restaurant", "search",
+)
+# 계획/비교 등 깊은 추론이 필요해 보이는 표현
+REASONING_HINTS = (
+    "계획", "추천", "비교", "분석", "이유", "왜", "설명", "단계", "정리", "장단점", "일정",
+    "plan", "compare", "analy", "explain", "why", "step",
+)
+
+
+@dataclass
+class RouteDecision:
+    tier: str    # FAST_TIER 또는 SMART_TIER
+    reason: str  # 분류 근거 (표시용)
+
+
+def classify_turn(text: str, has_tool_context: bool = False) -> RouteDecision:
+    """로컬 규칙 기반 분류기: 도구나 깊은 추론이 필요 없는 턴이면 FAST_TIER를 반환합니다."""
+    normalized = (text or "").strip().lower()
+
+    if has_tool_context:
+        return RouteDecision(SMART_TIER, "도구 결과 첨부")
+    for hint in TOOL_HINTS:
+        if hint in normalized:
+            return RouteDecision(SMART_TIER, f"도구 필요 ('{hint}')")
+    for hint in REASONING_HINTS:
+        if hint in normalized:
+            return RouteDecision(SMART_TIER, f"추론 필요 ('{hint}')")
+    if len(normalized) > FAST_MAX_CHARS or re.search(r"\n|```", normalized):
+        return RouteDecision(SMART_TIER, "긴 입력")
+    return RouteDecision(FAST_TIER, "짧은 일상 대화")
+
+
+def build_anthropic_models(api_key: str, temperature: float = DEFAULT_TEMPERATURE):
+    """tier별 ChatAnthropic 인스턴스를 생성합니다. (테스트 시에는 가짜 모델 dict를 대신 사용)"""
+    from langchain_anthropic import ChatAnthropic
+    return {
+        FAST_TIER: ChatAnthropic(model=FAST_MODEL, temperature=temperature, api_key=api_key),
+        SMART_TIER: ChatAnthropic(model=SMART_MODEL, temperature=temperature, api_key=api_key),
+    }
+
+
+def new_routing_stats():
+    """세션에 보관할 누적 통계 (tier별 호출 수/누적 지연/누적 출력 글자 수, 절약 시간 합계)."""
+    return {
+        "count": {FAST_TIER: 0, SMART_TIER: 0},
+        "latency_total": {FAST_TIER: 0.0, SMART_TIER: 0.0},
+        "chars_total": {FAST_TIER: 0, SMART_TIER: 0},
+        "saved_total": 0.0,
+    }
+
+
+class ModelRouter:
+    """턴마다 분류기로 tier를 정하고, 사용 모델과 지연 시간/절약 시간을 기록합니다."""
+
+    def __init__(self, models: dict, stats: dict = None, classifier=classify_turn):
+        self.models = models
+        self.stats = stats if stats is not None else new_routing_stats()
+        self.classifier = classifier
+
+    def route(self, text: str, **context) -> RouteDecision:
+        decision = self.classifier(text, **context)
+        if decision.tier not in self.models:
+            # 해당 tier 모델이 없으면 큰 모델로 대체
+            decision = RouteDecision(SMART_TIER, decision.reason)
+        return decision
+
+    def model_for(self, decision: RouteDecision):
+        return self.models[decision.tier]
+
+    def model_name(self, decision: RouteDecision) -> str:
+        model = self.model_for(decision)
+        return getattr(model, "model", None) or getattr(model, "model_name", None) or decision.tier
+
+    def baseline_latency(self, output_chars: int):
+        """큰 모델이 같은 길이의 응답을 냈을 때의 예상 지연 (출력 글자당 초 × 글자 수). 기준값이 없으면 None."""
+        smart_chars = self.stats["chars_total"][SMART_TIER]
+        if not smart_chars:
+            return None
+        return self.stats["latency_total"][SMART_TIER] / smart_chars * output_chars
+
+    def record(self, decision: RouteDecision, latency: float, output_chars: int, used_tools: bool = False) -> dict:
+        """정상 완료된 한 턴의 결과를 통계에 반영하고, 표시용 턴 기록을 반환합니다.
+        (오류로 끝난 턴은 기록하지 않습니다.) 절약 시간은 턴 길이에 맞춘 큰 모델 기준값과 비교해 추정합니다.
+        도구를 호출한 턴은 지연에 도구 실행/여러 번의 왕복이 섞여 있으므로 기준값 계산과 절약 시간 추정에서 제외합니다."""
+        tier = decision.tier
+        saved = None
+        if tier == FAST_TIER and not used_tools and (baseline := self.baseline_latency(output_chars)) is not None:
+            saved = max(baseline - latency, 0.0)
+            self.stats["saved_total"] += saved
+
+        self.stats["count"][tier] += 1
+        if not used_tools:
+            self.stats["latency_total"][tier] += latency
+            self.stats["chars_total"][tier] += output_chars
+
+        return {
+            "tier": tier,
+            "model": self.model_name(decision),
+            "reason": decision.reason,
+            "latency": round(latency, 3),
+            "saved": None if saved is None else round(saved, 3),
+        }
+
+
+def format_route_caption(route_info: dict) -> str:
+    """assistant 메시지 아래에 표시할 한 줄 요약."""
+    caption = f"⚡ {route_info['model']} · {route_info['reason']} · {route_info['latency']:.2f}초"
+    if route_info.get("saved"):
+        caption += f" (약 {route_info['saved']:.2f}초 절약)"
+    return caption
+
+
+def format_routing_summary(stats: dict) -> str:
+    """사이드바에 표시할 누적 라우팅 요약."""
+    return (
+        f"빠른 모델 {stats['count'][FAST_TIER]}회 · 큰 모델 {stats['count'][SMART_TIER]}회 · "
+        f"절약 시간 약 {stats['saved_total']:.1f}초"
+    )
+
+
+# 실행 확인용 (가짜 스트리밍 모델로 오프라인 라우팅 테스트: 페이지와 같은 route → stream → record 흐름)
+if __name__ == '__main__':
+    class FakeStreamingModel:
+        def __init__(self, model, delay_per_char):
+            self.model = model
+            self.delay_per_char = delay_per_char
+
+        def stream(self, text):
+            for char in f"[{self.model}] {text}":
+                time.sleep(self.delay_per_char)
+                yield char
+
+    router = ModelRouter({FAST_TIER: FakeStreamingModel("fake-fast", 0.0002), SMART_TIER: FakeStreamingModel("fake-smart", 0.001)})
+    for sample in ["내일 신촌에서 피크닉을 할 계획이야. 날씨와 맛집 정보를 바탕으로 계획을 세워줘", "안녕!", "고마워"]:
+        decision = router.route(sample)
+        start = time.perf_counter()
+        output = "".join(router.model_for(decision).stream(sample))
+        info = router.record(decision, time.perf_counter() - start, len(output))
+        print("*", output, asdict(decision), info)
+    # 도구를 호출한 턴은 기준값에 섞이지 않음
+    baseline_before = router.baseline_latency(100)
+    router.record(RouteDecision(SMART_TIER, "도구 필요"), 30.0, 10, used_tools=True)
+    assert router.baseline_latency(100) == baseline_before
+    assert router.route("안녕!").tier == FAST_TIER
+    assert router.route("서울 날씨 어때?").tier == SMART_TIER
+    assert router.route("안녕!", has_tool_context=True).tier == SMART_TIER
+    assert router.stats["count"] == {FAST_TIER: 2, SMART_TIER: 2} and router.stats["saved_total"] > 0
+    print("* stats:", format_routing_summary(router.stats))
@@ -1,13 +1,18 @@
 import streamlit as st
-from langchain_core.messages import HumanMessage, AIMessage # AIMessageChunk 제거
 from langchain.memory import ConversationBufferMemory
-from langchain.chains import LLMChain
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from dotenv import load_dotenv
 import os
-import uuid
-import asyncio
-import time # time 모듈 추가
+import sys
+
+# model_router.py 경로 설정 (현재 파일 기준 상위 폴더)
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+from model_router import ModelRouter, build_anthropic_models, new_routing_stats, format_route_caption, format_routing_summary
+from chat_history import render_history
+from message_pipeline import llm_token_events, stream_turn, turn_text, restored_turns, render_message
+from transcript_store import get_session_transcript
 
 # .env 파일 로드 (파일이 존재할 경우)
 load_dotenv()
@@ -25,14 +30,8 @@ try:
         print("접근 실패")
         raise ValueError("ANTHROPIC_API_KEY가 환경 변수 또는 secrets.toml에 설정되지 않았습니다.")
 
-    # Claude 모델 사용
-    from langchain_anthropic import ChatAnthropic
-    llm = ChatAnthropic(
-        model="claude-3-5-sonnet-latest",
-        temperature=0.7,
-        api_key=anthropic_api_key,
-        # streaming=True # LLMChain에서 stream을 사용하려면 이 옵션은 제거하거나, chain의 stream 메소드를 활용해야 합니다.
-    )
+    # Claude 모델 사용 (턴별로 빠른 모델/큰 모델 중 라우팅)
+    models = build_anthropic_models(anthropic_api_key)
 except ValueError as e: # 명시적 오류 처리
     st.error(e)
     st.stop()
@@ -40,11 +39,19 @@ except Exception as e: # 기타 오류
     st.error(f"LLM 초기화 오류: {e}")
     st.stop()
 
+# --- 채팅 기록 관리 (표시용 기록, 최근 일부만 메모리에 두고 나머지는 저장소에 보관) ---
+DISPLAY_MESSAGES_KEY = "no_tools_display_messages_v7"
+transcript = get_session_transcript(DISPLAY_MESSAGES_KEY)
+
 # --- 프롬프트 템플릿 및 메모리 설정 ---
 # 페이지별 고유 메모리 키
 MEMORY_KEY = "no_tools_memory"
 if MEMORY_KEY not in st.session_state:
     st.session_state[MEMORY_KEY] = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+    # 재접속으로 표시용 기록이 복원된 경우, 모델 메모리도 같은 대화로 복원
+    if transcript.restored:
+        for turn_input, turn_output in restored_turns(transcript.load_all()):
+            st.session_state[MEMORY_KEY].save_context({"input": turn_input}, {"output": turn_output})
 
 memory = st.session_state[MEMORY_KEY]
 
@@ -60,73 +67,54 @@ prompt_template = ChatPromptTemplate.from_messages(
     ]
 )
 
-# LLMChain 생성
-chain = LLMChain(llm=llm, prompt=prompt_template, memory=memory)
+# 모델 라우터 (통계는 세션별로 유지)
+ROUTING_STATS_KEY = "no_tools_routing_stats"
+if ROUTING_STATS_KEY not in st.session_state:
+    st.session_state[ROUTING_STATS_KEY] = new_routing_stats()
+router = ModelRouter(models, stats=st.session_state[ROUTING_STATS_KEY])
+
+# 누적 라우팅 요약 (응답 후 rerun 없이 갱신하도록 placeholder 사용)
+routing_summary = st.sidebar.empty()
+routing_summary.caption(format_routing_summary(router.stats))
+
+# 체인 생성 (라우팅된 모델마다 같은 프롬프트/메모리 공유, 토큰 단위 스트리밍)
+def build_chain(model):
+    return prompt_template | model
 
 
 # --- Streamlit UI 설정 ---
 st.title("도구 없는 AI 챗봇🚫")
 st.write("학습된 정보와 프롬프트를 바탕으로 대답합니다. 외부 도구는 사용할 수 없습니다.")
 
-# --- 채팅 기록 관리 (표시용 리스트 추가) ---
-DISPLAY_MESSAGES_KEY = "no_tools_display_messages_v6"
-if DISPLAY_MESSAGES_KEY not in st.session_state:
-    st.session_state[DISPLAY_MESSAGES_KEY] = []
-
-# --- 타이핑 효과 제너레이터 --- 
-def typing_effect_generator(text: str, speed: float = 0.01):
-    for char in text:
-        yield char
-        time.sleep(speed)
-
-# --- 렌더링 함수 정의 --- 
-def render_message_data(msg_data, is_new=False): # is_new 인자 추가
-    role = msg_data.get("role")
-    content = msg_data.get("content")
-    if role == "user":
-        with st.chat_message("user"):
-            st.markdown(content)
-    elif role == "assistant":
-        with st.chat_message("assistant"):
-             if content:
-                 # is_new 플래그는 호출하는 곳에서 write_stream 사용 여부 결정
-                 # 여기서는 항상 markdown (저장된 기록 표시용)
-                 st.markdown(content)
-
-# --- 이전 대화 기록 표시 ---
-for msg_data in st.session_state[DISPLAY_MESSAGES_KEY]:
-    render_message_data(msg_data, is_new=False) # 이전 기록은 is_new=False
+# --- 이전 대화 기록 표시 (최근 턴만 렌더링) ---
+render_history(st.session_state[DISPLAY_MESSAGES_KEY], render_message, key=DISPLAY_MESSAGES_KEY)
 
 # --- 사용자 입력 및 AI 응답 처리 (챗봇 2와 동일 로직) ---
 if user_input := st.chat_input("내일 신촌에서 피크닉을 할 계획이야. 날씨와 맛집 정보를 바탕으로 계획을 세워줘"):
     # 1. 사용자 메시지 저장 및 즉시 렌더링
     user_msg = {"role": "user", "content": user_input}
     st.session_state[DISPLAY_MESSAGES_KEY].append(user_msg)
-    render_message_data(user_msg) # is_new=False로 즉시 마크다운 렌더링
-    # 메모리는 invoke 시점에 업데이트됨
+    render_message(user_msg)
 
-    # 2. AI 응답 생성 및 즉시 렌더링 (타이핑 효과)
+    # 2. AI 응답 스트리밍 및 즉시 렌더링 (공통 스트리밍 파이프라인)
     with st.chat_message("assistant"):
-            try:
-                # invoke 사용하여 전체 응답 받기
-                response = chain.invoke({"input": user_input})
-                final_response_content = response.get('text', response.get('response', "응답 내용을 찾을 수 없습니다."))
-                if not isinstance(final_response_content, str):
-                     final_response_content = str(final_response_content)
-                
-                # 타이핑 효과로 즉시 렌더링하고 최종 내용 저장
-                if final_response_content:
-                     # st.write_stream 호출하여 즉시 렌더링
-                     displayed_response = st.write_stream(typing_effect_generator(final_response_content))
-                     # 최종 문자열 저장
-                     st.session_state[DISPLAY_MESSAGES_KEY].append({"role": "assistant", "content": displayed_response})
-                     # 메모리 자동 추가
-                
-            except Exception as e:
-                 # 오류 메시지 렌더링 및 저장
-                 error_message = f"LLM 응답 생성 중 오류 발생: {e}"
-                 st.error(error_message) 
-                 st.session_state[DISPLAY_MESSAGES_KEY].append({"role": "assistant", "content": error_message})
+        route_decision = router.route(user_input) # 이번 턴에 사용할 모델 결정
+        chat_history = memory.load_memory_variables({})["chat_history"]
+        events = llm_token_events(build_chain(router.model_for(route_decision)).stream({"input": user_input, "chat_history": chat_history}))
+        turn_records, metrics = stream_turn(events, error_prefix="LLM 응답 생성 중 오류 발생")
+
+        # 정상 응답이면 사용 모델/지연 시간 기록 및 메모리에 추가 (오류/빈 응답은 통계와 메모리에서 제외)
+        route_info = None
+        if not metrics.error and turn_records:
+            response_text = turn_text(turn_records)
+            route_info = router.record(route_decision, metrics.source_wait, len(response_text))
+            st.caption(format_route_caption(route_info))
+            routing_summary.caption(format_routing_summary(router.stats))
+            memory.save_context({"input": user_input}, {"output": response_text})
+
+        # 빈 응답은 저장하지 않음 (오류 메시지는 저장)
+        if turn_records:
+            st.session_state[DISPLAY_MESSAGES_KEY].append({"role": "assistant", "content": turn_records, "routing": route_info})
 
     # rerun 제거
 
@@ -1,16 +1,11 @@
 import streamlit as st
-from langchain_core.messages import HumanMessage, AIMessage # AIMessageChunk 제거
 from langchain.memory import ConversationBufferMemory # 메모리 추가
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder # 프롬프트 추가
-from langchain.chains import LLMChain # LLMChain 추가
 import json
-import uuid # uuid 임포트
 import sys
 import os
-import asyncio
 import re # 키워드 검색을 위해 추가
 from dotenv import load_dotenv # dotenv 임포트
-import time # time 모듈 추가
 
 # .env 파일 로드
 load_dotenv()
@@ -21,6 +16,10 @@ parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 # Agent용 @tool 함수 대신 시뮬레이션용 일반 함수 임포트
 from tools import get_seoul_weather_data, get_picnic_restaurant_data
+from model_router import ModelRouter, build_anthropic_models, new_routing_stats, format_route_caption, format_routing_summary
+from chat_history import render_history
+from message_pipeline import prepare_tool_view, llm_token_events, stream_turn, turn_text, restored_turns, render_message
+from transcript_store import get_session_transcript
 
 # --- LLM 설정 (기존과 동일) ---
 try:
@@ -31,12 +30,8 @@ try:
     if not anthropic_api_key:
         raise ValueError("ANTHROPIC_API_KEY가 환경 변수 또는 secrets.toml에 설정되지 않았습니다.")
 
-    from langchain_anthropic import ChatAnthropic
-    llm = ChatAnthropic(
-        model="claude-3-5-sonnet-latest",
-        temperature=0.7,
-        api_key=anthropic_api_key
-    )
+    # 턴별로 빠른 모델/큰 모델 중 라우팅
+    models = build_anthropic_models(anthropic_api_key)
 except ValueError as e:
     print("접근 실패")
     st.error(e)
@@ -45,11 +40,19 @@ except Exception as e:
     st.error(f"LLM 초기화 오류: {e}")
     st.stop()
 
-# --- 프롬프트 및 메모리 설정 (기존과 동일) ---
+# --- 채팅 기록 관리 (표시용 기록, 최근 일부만 메모리에 두고 나머지는 저장소에 보관) ---
+DISPLAY_MESSAGES_KEY = "explicit_display_messages_v7"
+transcript = get_session_transcript(DISPLAY_MESSAGES_KEY)
+
+# --- 프롬프트 및 메모리 설정 ---
 # 페이지별 고유 메모리 키
 MEMORY_KEY = "explicit_memory"
 if MEMORY_KEY not in st.session_state:
     st.session_state[MEMORY_KEY] = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+    # 재접속으로 표시용 기록이 복원된 경우, 모델 메모리도 같은 대화로 복원 (도구 결과가 포함된 입력 그대로)
+    if transcript.restored:
+        for turn_input, turn_output in restored_turns(transcript.load_all()):
+            st.session_state[MEMORY_KEY].save_context({"input": turn_input}, {"output": turn_output})
 
 memory = st.session_state[MEMORY_KEY]
 
@@ -71,8 +74,15 @@ prompt_template = ChatPromptTemplate.from_messages(
     ]
 )
 
-# LLMChain 생성
-chain = LLMChain(llm=llm, prompt=prompt_template, memory=memory)
+# 모델 라우터 (통계는 세션별로 유지)
+ROUTING_STATS_KEY = "explicit_routing_stats"
+if ROUTING_STATS_KEY not in st.session_state:
+    st.session_state[ROUTING_STATS_KEY] = new_routing_stats()
+router = ModelRouter(models, stats=st.session_state[ROUTING_STATS_KEY])
+
+# 체인 생성 (라우팅된 모델마다 같은 프롬프트/메모리 공유, 토큰 단위 스트리밍)
+def build_chain(model):
+    return prompt_template | model
 
 
 # --- Streamlit UI 설정 (기존과 동일) ---
@@ -81,46 +91,8 @@ st.write("""
 프롬프트 입력 시 추가적인 도구를 사용할 수 있습니다. \n
 **사이드바의 토글 버튼**을 이용해 미리 준비된 정보를 질문에 첨부해 보세요.""")
 
-# --- 채팅 기록 관리 (표시용 리스트 추가) ---
-DISPLAY_MESSAGES_KEY = "explicit_display_messages_v6"
-if DISPLAY_MESSAGES_KEY not in st.session_state:
-    st.session_state[DISPLAY_MESSAGES_KEY] = []
-
-# --- 타이핑 효과 제너레이터 --- 
-def typing_effect_generator(text: str, speed: float = 0.01):
-    for char in text:
-        yield char
-        time.sleep(speed)
-
-# --- 렌더링 함수 정의 (수정) ---
-def render_message_data(msg_data):
-    role = msg_data.get("role")
-    content = msg_data.get("content")
-    name = msg_data.get("name")
-
-    if role == "user":
-        with st.chat_message("user"):
-            st.markdown(content)
-    elif role == "assistant":
-        # 저장된 기록은 항상 마크다운으로 표시
-        with st.chat_message("assistant"):
-            if content:
-                 st.markdown(content)
-    elif role == "tool_result": 
-         with st.expander(f"첨부된 {name} 정보", expanded=True):
-              is_restaurant_tool = name and ("맛집" in name or "restaurant" in name.lower())
-              try:
-                  parsed_content = json.loads(content) if isinstance(content, str) else content
-                  if is_restaurant_tool and isinstance(parsed_content, list):
-                       st.dataframe(parsed_content)
-                  else:
-                      st.code(json.dumps(parsed_content, indent=2, ensure_ascii=False, default=str), language='json')
-              except (json.JSONDecodeError, TypeError):
-                  st.code(str(content), language='text')
-
-# --- 이전 대화 기록 표시 ---
-for msg_data in st.session_state[DISPLAY_MESSAGES_KEY]:
-    render_message_data(msg_data)
+# --- 이전 대화 기록 표시 (최근 턴만 렌더링) ---
+render_history(st.session_state[DISPLAY_MESSAGES_KEY], render_message, key=DISPLAY_MESSAGES_KEY)
 
 # --- 도구 활성화 버튼 (사이드바) ---
 with st.sidebar:
@@ -133,12 +105,16 @@ with st.sidebar:
         st.session_state.activate_restaurants = False
     st.session_state.activate_restaurants = st.toggle("맛집 검색", value=st.session_state.activate_restaurants, key="resto_toggle", help="활성화하고 질문하면 미리 준비된 '피크닉 음식' 맛집 정보를 함께 전달합니다.")
 
+    # 누적 라우팅 요약 (응답 후 rerun 없이 갱신하도록 placeholder 사용)
+    routing_summary = st.empty()
+    routing_summary.caption(format_routing_summary(router.stats))
+
 # --- 사용자 입력 및 AI 응답 처리 (즉시 렌더링) ---
 if prompt := st.chat_input("내일 신촌에서 피크닉을 할 계획이야. 날씨와 맛집 정보를 바탕으로 계획을 세워줘."):
     # 1. 사용자 메시지 저장 및 즉시 렌더링
     user_msg = {"role": "user", "content": prompt}
     st.session_state[DISPLAY_MESSAGES_KEY].append(user_msg)
-    render_message_data(user_msg)
+    render_message(user_msg)
 
     tool_results_text = "" # LLM 입력용
 
@@ -148,9 +124,9 @@ if prompt := st.chat_input("내일 신촌에서 피크닉을 할 계획이야. 
             weather_result = get_seoul_weather_data()
             result_str = json.dumps(weather_result, ensure_ascii=False)
             tool_results_text += f"\n\n[날씨 정보 (서울)]\n{result_str}"
-            tool_data = {"role": "tool_result", "name": "날씨 (서울)", "content": result_str}
+            tool_data = {"role": "tool_result", "name": "날씨 (서울)", "view": prepare_tool_view("날씨 (서울)", result_str)} # 렌더링용 view만 보관
             st.session_state[DISPLAY_MESSAGES_KEY].append(tool_data)
-            render_message_data(tool_data) # 도구 결과 즉시 렌더링
+            render_message(tool_data) # 도구 결과 즉시 렌더링
         except Exception as e:
             st.error(f"날씨 정보 확인 중 오류: {e}") 
         st.session_state.activate_weather = False
@@ -160,31 +136,35 @@ if prompt := st.chat_input("내일 신촌에서 피크닉을 할 계획이야. 
              resto_result = get_picnic_restaurant_data()
              result_str = json.dumps(resto_result, indent=2, ensure_ascii=False)
              tool_results_text += f"\n\n[맛집 정보 (피크닉 음식)]\n{result_str}"
-             tool_data = {"role": "tool_result", "name": "맛집 (피크닉 음식)", "content": result_str}
+             tool_data = {"role": "tool_result", "name": "맛집 (피크닉 음식)", "view": prepare_tool_view("맛집 (피크닉 음식)", result_str)} # 렌더링용 view만 보관
              st.session_state[DISPLAY_MESSAGES_KEY].append(tool_data)
-             render_message_data(tool_data) # 도구 결과 즉시 렌더링
+             render_message(tool_data) # 도구 결과 즉시 렌더링
         except Exception as e:
             st.error(f"맛집 정보 검색 중 오류: {e}")
         st.session_state.activate_restaurants = False
 
     # 3. LLM 입력 구성 및 응답 생성/렌더링/저장
     final_input_for_llm = prompt + tool_results_text
-    # 메모리 자동 추가됨 (invoke 사용 시)
     with st.chat_message("assistant"):
-            try:
-                # invoke로 전체 응답 받기
-                response = chain.invoke({"input": final_input_for_llm})
-                final_response_content = response.get('text', response.get('response', "응답 내용을 찾을 수 없습니다."))
-                if not isinstance(final_response_content, str): final_response_content = str(final_response_content)
-                
-                if final_response_content:
-                     # 타이핑 효과로 즉시 렌더링
-                     displayed_response = st.write_stream(typing_effect_generator(final_response_content))
-                     # 최종 내용 저장
-                     st.session_state[DISPLAY_MESSAGES_KEY].append({"role": "assistant", "content": displayed_response})
-                     # 메모리 자동 추가
-            
-            except Exception as e:
-                 error_message = f"LLM 응답 생성 중 오류 발생: {e}"
-                 st.error(error_message) 
-                 st.session_state[DISPLAY_MESSAGES_KEY].append({"role": "assistant", "content": error_message})
+        # 라우터가 모델 결정 (분류는 사용자 질문 기준, 도구 결과가 있으면 큰 모델)
+        route_decision = router.route(prompt, has_tool_context=bool(tool_results_text))
+        chat_history = memory.load_memory_variables({})["chat_history"]
+        events = llm_token_events(build_chain(router.model_for(route_decision)).stream({"input": final_input_for_llm, "chat_history": chat_history}))
+        turn_records, metrics = stream_turn(events, error_prefix="LLM 응답 생성 중 오류 발생")
+
+        # 정상 응답이면 사용 모델/지연 시간 기록 및 메모리에 추가 (오류/빈 응답은 통계와 메모리에서 제외)
+        # 메모리에는 도구 결과가 포함된 입력 그대로 저장
+        route_info = None
+        if not metrics.error and turn_records:
+            response_text = turn_text(turn_records)
+            route_info = router.record(route_decision, metrics.source_wait, len(response_text))
+            st.caption(format_route_caption(route_info))
+            routing_summary.caption(format_routing_summary(router.stats))
+            memory.save_context({"input": final_input_for_llm}, {"output": response_text})
+
+        # 빈 응답은 저장하지 않음 (오류 메시지는 저장)
+        if turn_records:
+            assistant_msg = {"role": "assistant", "content": turn_records, "routing": route_info}
+            if tool_results_text:
+                assistant_msg["llm_input"] = final_input_for_llm # 재접속 시 메모리 복원용
+            st.session_state[DISPLAY_MESSAGES_KEY].append(assistant_msg)
@@ -0,0 +1,267 @@
+# transcript_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import streamlit as st
+
+# === 대화 기록 저장소 설정 ===
+# 표시용 대화 기록은 SQLite에 append-only로 쌓고, 세션 메모리에는 최근 일부만 유지합니다.
+DB_PATH = os.getenv(
+    "TRANSCRIPT_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".transcripts", "transcripts.sqlite3"),
+)
+RECENT_WINDOW = 40  # 세션 메모리에 유지할 최근 메시지 수
+# 보존 규칙: 오래된 기록과 대화별 최대 메시지 수를 넘는 기록은 주기적으로 삭제
+RETENTION_DAYS = float(os.getenv("TRANSCRIPT_RETENTION_DAYS", "7"))
+MAX_MESSAGES_PER_TRANSCRIPT = int(os.getenv("TRANSCRIPT_MAX_MESSAGES", "1000"))
+PRUNE_EVERY = 200  # 이만큼 append 할 때마다 보존 규칙 적용
+# 재접속 시 같은 기록을 찾기 위한 URL 파라미터.
+# 별도 인증이 없으므로 sid는 bearer token 입니다: sid가 포함된 URL을 가진 사람은 그 대화를 볼 수 있습니다.
+SESSION_QUERY_PARAM = "sid"
+SESSION_ID_KEY = "transcript_session_id"
+
+
+class TranscriptStore:
+    """(session_id, transcript) 단위로 메시지를 순서대로 저장하는 SQLite 저장소."""
+
+    def __init__(self, path: str = DB_PATH, retention_days: float = RETENTION_DAYS,
+                 max_messages: int = MAX_MESSAGES_PER_TRANSCRIPT):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Streamlit은 세션마다 다른 스레드에서 실행되므로 연결 하나를 lock으로 보호해 공유
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.retention_days = retention_days
+        self.max_messages = max_messages
+        self._appends_since_prune = 0
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS messages (
+                       seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                       session_id TEXT NOT NULL,
+                       transcript TEXT NOT NULL,
+                       role TEXT,
+                       data TEXT NOT NULL,
+                       created_at REAL NOT NULL DEFAULT 0
+                   )"""
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(messages)")]
+            if "created_at" not in columns:  # created_at 이전에 만들어진 DB
+                self._conn.execute("ALTER TABLE messages ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_messages_transcript ON messages (session_id, transcript, seq)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages (created_at)")
+        self.prune()
+
+    def append(self, session_id: str, transcript: str, message: dict) -> int:
+        data = json.dumps(message, ensure_ascii=False, default=str)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO messages (session_id, transcript, role, data, created_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, transcript, message.get("role"), data, time.time()),
+            )
+            self._appends_since_prune += 1
+            should_prune = self._appends_since_prune >= PRUNE_EVERY
+        if should_prune:
+            self.prune()
+        return cursor.lastrowid
+
+    def prune(self) -> int:
+        """보존 기간이 지난 메시지와, 대화별로 최근 max_messages개를 넘는 메시지를 삭제합니다. 삭제한 행 수를 반환합니다."""
+        with self._lock, self._conn:
+            self._appends_since_prune = 0
+            deleted = self._conn.execute(
+                "DELETE FROM messages WHERE created_at < ?",
+                (time.time() - self.retention_days * 86400,),
+            ).rowcount
+            deleted += self._conn.execute(
+                """DELETE FROM messages WHERE seq IN (
+                       SELECT seq FROM (
+                           SELECT seq, ROW_NUMBER() OVER (PARTITION BY session_id, transcript ORDER BY seq DESC) AS rank
+                           FROM messages
+                       ) WHERE rank > ?
+                   )""",
+                (self.max_messages,),
+            ).rowcount
+        return deleted
+
+    def _select(self, sql: str, params: tuple) -> list:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        messages = []
+        for seq, data in rows:
+            message = json.loads(data)
+            message["seq"] = seq
+            messages.append(message)
+        return messages
+
+    def load_recent(self, session_id: str, transcript: str, limit: int) -> list:
+        """최근 limit개 메시지를 오래된 순서로 반환합니다."""
+        messages = self._select(
+            "SELECT seq, data FROM messages WHERE session_id = ? AND transcript = ? ORDER BY seq DESC LIMIT ?",
+            (session_id, transcript, limit),
+        )
+        messages.reverse()
+        return messages
+
+    def load_range(self, session_id: str, transcript: str, start_seq: int, end_seq: int) -> list:
+        """start_seq <= seq < end_seq 구간의 메시지를 반환합니다."""
+        return self._select(
+            "SELECT seq, data FROM messages WHERE session_id = ? AND transcript = ? AND seq >= ? AND seq < ? ORDER BY seq",
+            (session_id, transcript, start_seq, end_seq),
+        )
+
+    def turn_start_before(self, session_id: str, transcript: str, before_seq: int, turns: int):
+        """before_seq 이전에서 뒤로 turns번째 user 메시지의 seq. 턴이 부족하면 가장 오래된 seq를 반환합니다."""
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT seq FROM messages WHERE session_id = ? AND transcript = ? AND role = 'user' AND seq < ?
+                   ORDER BY seq DESC LIMIT 1 OFFSET ?""",
+                (session_id, transcript, before_seq, turns - 1),
+            ).fetchone()
+            if row is None:
+                row = self._conn.execute(
+                    "SELECT MIN(seq) FROM messages WHERE session_id = ? AND transcript = ? AND seq < ?",
+                    (session_id, transcript, before_seq),
+                ).fetchone()
+        return row[0]
+
+    def count_turns_before(self, session_id: str, transcript: str, before_seq: int) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ? AND transcript = ? AND role = 'user' AND seq < ?",
+                (session_id, transcript, before_seq),
+            ).fetchone()
+        return row[0]
+
+
+class SessionTranscript:
+    """세션의 표시용 대화 기록. 최근 window개 메시지만 메모리에 두고 나머지는 저장소에서 필요할 때 읽습니다."""
+
+    def __init__(self, store: TranscriptStore, session_id: str, name: str, window: int = RECENT_WINDOW):
+        self.store = store
+        self.session_id = session_id
+        self.name = name
+        self.window = window
+        # 재접속한 경우 저장소에서 최근 기록을 복원
+        self.recent = store.load_recent(session_id, name, window)
+        self.restored = bool(self.recent)
+
+    def append(self, message: dict):
+        message["seq"] = self.store.append(self.session_id, self.name, message)
+        self.recent.append(message)
+        if len(self.recent) > self.window:
+            del self.recent[:-self.window]
+
+    def __iter__(self):
+        return iter(self.recent)
+
+    def __len__(self):
+        return len(self.recent)
+
+    def load_all(self) -> list:
+        """저장소에 남아 있는 전체 기록을 읽습니다. (재접속 시 모델 메모리 복원용, 보관하지 않음)"""
+        if not self.recent:
+            return []
+        return self.store.load_range(self.session_id, self.name, 0, self.recent[-1]["seq"] + 1)
+
+    def tail_turns(self, turns: int):
+        """최근 turns개 턴의 메시지와 그 이전에 숨겨진 턴 수를 반환합니다.
+        메모리 window에 없는 오래된 턴은 저장소에서 읽기만 하고 보관하지 않습니다."""
+        start, seen_turns = None, 0
+        for index in range(len(self.recent) - 1, -1, -1):
+            if self.recent[index].get("role") == "user":
+                seen_turns += 1
+                if seen_turns == turns:
+                    start = index
+                    break
+
+        if start is not None or not self.recent:
+            messages = self.recent[start or 0:]
+        else:
+            # window 밖의 턴이 더 필요하면 저장소에서 이어서 읽음
+            oldest_seq = self.recent[0]["seq"]
+            start_seq = self.store.turn_start_before(self.session_id, self.name, oldest_seq, turns - seen_turns)
+            older = [] if start_seq is None else self.store.load_range(self.session_id, self.name, start_seq, oldest_seq)
+            messages = older + self.recent
+
+        hidden_turns = self.store.count_turns_before(self.session_id, self.name, messages[0]["seq"]) if messages else 0
+        return messages, hidden_turns
+
+
+@st.cache_resource
+def get_transcript_store() -> TranscriptStore:
+    return TranscriptStore(DB_PATH)
+
+
+def get_session_id() -> str:
+    """URL 파라미터에 세션 ID를 기록해, 재접속(새 세션)에서도 같은 기록을 이어 씁니다."""
+    session_id = st.session_state.get(SESSION_ID_KEY) or st.query_params.get(SESSION_QUERY_PARAM) or uuid.uuid4().hex
+    st.session_state[SESSION_ID_KEY] = session_id
+    if st.query_params.get(SESSION_QUERY_PARAM) != session_id:
+        st.query_params[SESSION_QUERY_PARAM] = session_id
+    return session_id
+
+
+def get_session_transcript(name: str) -> SessionTranscript:
+    """st.session_state[name]에 SessionTranscript를 두고 반환합니다.
+    (이전 버전이 남긴 list 등 다른 형식의 값이 있으면 새로 만듭니다.)"""
+    # st.navigation으로 페이지를 옮기면 query param이 사라지므로, 실행마다 ?sid=를 다시 기록
+    session_id = get_session_id()
+    if not isinstance(st.session_state.get(name), SessionTranscript):
+        st.session_state[name] = SessionTranscript(get_transcript_store(), session_id, name)
+    return st.session_state[name]
+
+
+# 실행 확인용 (메모리 SQLite로 오프라인 저장소/페이지 로직 테스트)
+if __name__ == '__main__':
+    def contents(messages):
+        return [m["content"] for m in messages]
+
+    store = TranscriptStore(":memory:", max_messages=1000)
+    transcript = SessionTranscript(store, "session-a", "demo", window=4)
+    for i in range(10):
+        transcript.append({"role": "user", "content": f"q{i}"})
+        transcript.append({"role": "assistant", "content": f"a{i}"})
+    assert contents(transcript.recent) == ["q8", "a8", "q9", "a9"]  # window만 메모리에 유지
+
+    # window 안
+    messages, hidden = transcript.tail_turns(2)
+    assert contents(messages) == ["q8", "a8", "q9", "a9"] and hidden == 8
+    # window 밖 (저장소에서 읽음, 메모리에는 보관하지 않음)
+    messages, hidden = transcript.tail_turns(5)
+    assert contents(messages) == [f"{r}{i}" for i in range(5, 10) for r in "qa"] and hidden == 5
+    assert len(transcript.recent) == 4
+    # 전체 기록보다 많이
+    messages, hidden = transcript.tail_turns(20)
+    assert len(messages) == 20 and hidden == 0
+    # window가 턴 중간에서 시작하는 경우
+    odd = SessionTranscript(store, "session-a", "demo", window=3)
+    assert contents(odd.recent) == ["a8", "q9", "a9"] and odd.restored
+    messages, hidden = odd.tail_turns(2)
+    assert contents(messages) == ["q8", "a8", "q9", "a9"] and hidden == 8
+    # 턴이 부족하면 가장 오래된 seq
+    oldest_seq = store.load_recent("session-a", "demo", 100)[0]["seq"]
+    assert store.turn_start_before("session-a", "demo", odd.recent[0]["seq"], 100) == oldest_seq
+
+    # 재접속 시 전체 기록 복원 / 다른 세션은 비어 있음
+    assert contents(odd.load_all()) == [f"{r}{i}" for i in range(10) for r in "qa"]
+    empty = SessionTranscript(store, "session-b", "demo")
+    assert empty.tail_turns(5) == ([], 0) and empty.load_all() == [] and not empty.restored
+
+    # 보존 규칙: 대화별로 최근 max_messages개만 유지
+    store.max_messages = 6
+    store.append("session-b", "demo", {"role": "user", "content": "b0"})
+    assert store.prune() == 20 - 6
+    assert contents(store.load_recent("session-a", "demo", 100)) == ["q7", "a7", "q8", "a8", "q9", "a9"]
+    assert contents(store.load_recent("session-b", "demo", 100)) == ["b0"]
+    # 보존 기간이 지난 기록 삭제
+    store.retention_days = 0
+    store.prune()
+    assert store.load_recent("session-a", "demo", 100) == []
+    print("* transcript_store: OK")